@@ -0,0 +1,88 @@
+"""Compares request latencies under a mixed load with and without a SchedulingPolicy.
+
+Bursts of slow bulk "analyze" requests are sent alongside a steady stream of fast "complete"
+requests (what an editor does when it reanalyzes files while the user types). Without a policy
+each completion waits behind the whole burst, with one it jumps the queue while aging makes
+sure the analysis still finishes.
+
+Run with: python benchmarks/mixed_load.py
+"""
+
+from os import close, remove
+from tempfile import mkstemp
+from time import perf_counter, sleep
+
+from collegamento import Client, SchedulingPolicy
+from collegamento.replay import LatencyStats, replay_trace
+
+
+def analyze(server, request) -> int:
+    end: float = perf_counter() + 0.02  # Bulk work
+    count: int = 0
+    while perf_counter() < end:
+        count += 1
+    return count
+
+
+def complete(server, request) -> str:
+    return request["prefix"] + "_completed"
+
+
+COMMANDS = {"analyze": (analyze, True), "complete": (complete, True)}
+
+
+def record_load(trace_file: str) -> None:
+    client = Client(COMMANDS)
+    client.start_recording(trace_file)
+
+    for tick in range(60):
+        if tick % 10 == 0:
+            for file in range(30):
+                client.request("analyze", file=file)
+        client.request("complete", prefix=f"word{tick}")
+        sleep(0.05)
+        client.check_responses()
+
+    client.stop_recording()
+    client.kill_IPC()
+
+
+def print_report(name: str, report: dict[str, LatencyStats]) -> None:
+    print(name)
+    for command in ("complete", "analyze"):
+        stats: LatencyStats = report[command]
+        print(
+            f"    {command:<10} p50 {stats['p50'] * 1000:8.1f} ms"
+            f"    p99 {stats['p99'] * 1000:8.1f} ms"
+            f"    max {stats['max'] * 1000:8.1f} ms"
+        )
+
+
+def main() -> None:
+    file_descriptor, trace_file = mkstemp(suffix=".gz")
+    close(file_descriptor)
+    record_load(trace_file)
+
+    fifo = Client(COMMANDS)
+    sleep(0.5)  # Let the Server start
+    print_report(
+        "No policy (first come first served)", replay_trace(trace_file, fifo)
+    )
+    fifo.kill_IPC()
+
+    weighted = Client(
+        COMMANDS,
+        scheduling_policy=SchedulingPolicy({"complete": 10}, aging_rate=5),
+    )
+    sleep(0.5)
+    print_report(
+        "SchedulingPolicy({'complete': 10}, aging_rate=5)",
+        replay_trace(trace_file, weighted),
+    )
+    weighted.kill_IPC()
+
+    remove(trace_file)
+
+
+if __name__ == "__main__":
+    main()
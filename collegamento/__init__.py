@@ -1,16 +1,27 @@
+from beartype import BeartypeConf
 from beartype.claw import beartype_this_package
 
-beartype_this_package()
+# Lets an int be given wherever a float is wanted
+beartype_this_package(conf=BeartypeConf(is_pep484_tower=True))
 
 from .client_server import (  # noqa: F401, E402
     COMMANDS_MAPPING,
     USER_FUNCTION,
     Client,
     CollegamentoError,
+    CommandProfile,
     Request,
     RequestQueueType,
     Response,
     ResponseQueueType,
+    SchedulingPolicy,
     Server,
+    WatchdogEvent,
+)
+from .file_store import FileStore  # noqa: F401, E402
+from .files_variant import (  # noqa: F401, E402
+    FILE_HOOK,
+    FileClient,
+    FileIndexes,
+    FileServer,
 )
-from .files_variant import FileClient, FileServer  # noqa: F401, E402
@@ -1,10 +1,13 @@
 from .client import Client, Server  # noqa: F401, E402
+from .scheduling import SchedulingPolicy  # noqa: F401, E402
 from .utils import (  # noqa: F401, E402
     COMMANDS_MAPPING,
     USER_FUNCTION,
     CollegamentoError,
+    CommandProfile,
     Request,
     RequestQueueType,
     Response,
     ResponseQueueType,
+    WatchdogEvent,
 )
@@ -14,11 +14,23 @@
 >>> c.kill_IPC()
 """
 
-from multiprocessing import Process, Queue, freeze_support
+from multiprocessing import Process, Queue, freeze_support, resource_tracker
 from random import randint
+from sys import platform
+from time import monotonic, time
 
+from beartype.typing import Any
+
+from .scheduling import SchedulingPolicy
 from .server import Server
+from .shared_results import (
+    discard_shared_result,
+    load_shared_result,
+    unpickle_result,
+)
+from .trace import TraceRecorder
 from .utils import (
+    BUILTIN_COMMANDS,
     COMMANDS_MAPPING,
     USER_FUNCTION,
     CollegamentoError,
@@ -26,7 +38,10 @@ from .utils import (
     RequestQueueType,
     Response,
     ResponseQueueType,
+    SharedResult,
+    WatchdogEvent,
 )
+from .watchdog import HEARTBEAT_TIMEOUT, Heartbeat
 
 
 class Client:
@@ -36,8 +51,15 @@ class Client:
 
     The public API includes the following methods:
     - Client.add_command(name: str, command: USER_FUNCTION, multiple_requests: bool = False)
-    - Client.request(command: str, **kwargs) -> None | int
+    - Client.request(command: str, request_priority: float | None = None, **kwargs) -> None | int
     - Client.get_response(command: str) -> Response | list[Response] | None
+    - Client.request_memory_report()
+    - Client.request_stats()
+    - Client.start_profiling()
+    - Client.stop_profiling(limit: int = 30)
+    - Client.start_recording(trace_file: str)
+    - Client.stop_recording()
+    - Client.get_watchdog_events() -> list[WatchdogEvent]
     - Client.kill_IPC()
     """
 
@@ -46,10 +68,21 @@ class Client:
         commands: COMMANDS_MAPPING = {},
         id_max: int = 15_000,
         server_type: type = Server,
+        large_result_threshold: int | None = None,
+        deduplicate_commands: list[str] | None = None,
+        hang_thresholds: dict[str, float] | None = None,
+        default_hang_threshold: float | None = None,
+        scheduling_policy: SchedulingPolicy | None = None,
+        server_kwargs: dict[str, Any] | None = None,  # Only used by subclasses
     ) -> None:
         """See tests, examples, and the file variant code to see how to give input.
 
-        The most common input is commands and id_max. server_type is only really useful for wrappers."""
+        The most common input is commands and id_max. server_type is only really useful for wrappers.
+        Results of at least large_result_threshold bytes are sent through shared memory instead of the Queue.
+        Identical pending requests for the multiple request commands in deduplicate_commands only run once.
+        A Server stuck in a command for longer than its hang threshold (in seconds, hang_thresholds
+        falls back to default_hang_threshold and None never times out) is restarted.
+        The scheduling_policy decides which pending request the Server runs next."""
 
         self.all_ids: list[int] = []
         self.id_max: int = id_max
@@ -59,6 +92,21 @@ class Client:
 
         self.newest_responses: dict[str, list[Response]] = {}
         self.server_type: type = server_type
+        # Given to the server_type as kwargs
+        self.server_kwargs: dict[str, Any] = {
+            "large_result_threshold": large_result_threshold,
+            "deduplicate_commands": deduplicate_commands or [],
+            "scheduling_policy": scheduling_policy,
+        } | (server_kwargs or {})
+        # Segment name -> (result, duplicate responses still to read it) so
+        # duplicates that share a segment reuse the first load
+        self.loaded_shared_results: dict[str, tuple[Any, int]] = {}
+        self.trace_recorder: TraceRecorder | None = None
+
+        self.hang_thresholds: dict[str, float] = hang_thresholds or {}
+        self.default_hang_threshold: float | None = default_hang_threshold
+        self.watchdog_events: list[WatchdogEvent] = []
+        self.heartbeat: Heartbeat
 
         self.commands: dict[str, tuple[USER_FUNCTION, bool]] = {}
 
@@ -72,6 +120,9 @@ class Client:
             self.commands[command] = func
             self.newest_responses[command] = []
 
+        for builtin in BUILTIN_COMMANDS:
+            self.newest_responses[builtin] = []
+
         self.request_queue: RequestQueueType
         self.response_queue: ResponseQueueType
         self.main_process: Process
@@ -89,8 +140,18 @@ class Client:
             self.check_responses()
             self.all_ids = []  # The remaining ones will never have been finished
 
+        if (
+            self.server_kwargs["large_result_threshold"] is not None
+            and platform != "win32"
+        ):
+            # The Server has to share our resource tracker or it would unlink segments
+            # we haven't read yet when it dies (Windows has no resource tracker)
+            resource_tracker.ensure_running()
+
         self.request_queue = Queue()
         self.response_queue = Queue()
+        self.heartbeat = Heartbeat()
+        self.server_kwargs["heartbeat"] = self.heartbeat
         self.main_process = Process(
             target=self.server_type,
             args=(
@@ -98,6 +159,7 @@ class Client:
                 self.request_queue,
                 self.response_queue,
             ),
+            kwargs=self.server_kwargs,
             daemon=True,
         )
         self.main_process.start()
@@ -105,6 +167,10 @@ class Client:
     def create_message_id(self) -> int:
         """Creates a Message id - internal API"""
 
+        # No point in an id if the server's dead (this has to come first as
+        # restarting the server forgets all ids)
+        self.check_server()
+
         # In cases where there are many many requests being sent it may be faster to choose a
         # random id than to iterate through the list of id's and find an unclaimed one
         # NOTE: 0 is reserved for when there's no curent id's (self.current_ids)
@@ -113,14 +179,68 @@ class Client:
             id = randint(1, self.id_max)
         self.all_ids.append(id)
 
-        if not self.main_process.is_alive():
-            # No point in an id if the server's dead
-            self.create_server()
-
         return id
 
-    def request(self, command: str, **kwargs) -> None:
-        """Sends the main process a request of type command with given kwargs - external API"""
+    def check_server(self) -> None:
+        """Restarts the Server if it has died or is stuck in a command for longer than
+        the command's hang threshold - internal API
+
+        Only the shared Heartbeat is read unless it looks stale so this is cheap."""
+
+        now: float = monotonic()
+        command_started: float = self.heartbeat.command_started
+        command: str | None = None
+        if command_started:
+            command = self.heartbeat.current_command
+            threshold: float | None = self.hang_thresholds.get(
+                command, self.default_hang_threshold
+            )
+            if threshold is not None and now - command_started > threshold:
+                self.restart_server("hung", command, now - command_started)
+                return
+
+        # There are no beats during a command so its start counts as one
+        last_sign_of_life: float = max(
+            self.heartbeat.last_beat, command_started
+        )
+        if now - last_sign_of_life < HEARTBEAT_TIMEOUT:
+            return
+
+        if self.main_process.is_alive():
+            return
+
+        self.restart_server("dead", command, now - last_sign_of_life)
+
+    def restart_server(
+        self, event_type: str, command: str | None, elapsed: float
+    ) -> None:
+        """Records a WatchdogEvent and restarts the Server - internal API"""
+
+        self.watchdog_events.append(
+            {
+                "type": event_type,
+                "command": command,
+                "elapsed": elapsed,
+                "time": time(),
+            }
+        )
+        self.create_server()
+
+    def get_watchdog_events(self) -> list[WatchdogEvent]:
+        """Gives every restart made by the watchdog since this was last called - external API"""
+
+        self.check_server()
+        events: list[WatchdogEvent] = self.watchdog_events
+        self.watchdog_events = []
+        return events
+
+    def request(
+        self, command: str, request_priority: float | None = None, **kwargs
+    ) -> None:
+        """Sends the main process a request of type command with given kwargs - external API
+
+        The request_priority overrides the command's weight in the Server's SchedulingPolicy
+        and is taken out of the request before the command gets it."""
 
         if command not in self.commands:
             raise CollegamentoError(
@@ -135,6 +255,12 @@ class Client:
             "command": command,
         }
         final_request.update(**kwargs)
+        if request_priority is not None:
+            final_request["request_priority"] = request_priority
+            kwargs["request_priority"] = request_priority  # So it's recorded
+
+        if self.trace_recorder is not None:
+            self.trace_recorder.record(command, kwargs)
 
         if self.commands[command][1]:
             self.current_ids[id] = command
@@ -156,6 +282,15 @@ class Client:
         if command == "add-command":
             return
 
+        if command in BUILTIN_COMMANDS:
+            self.newest_responses[command].append(res)
+            return
+
+        if "shared_result" in res:
+            res["result"] = self.load_shared_result(res.pop("shared_result"))
+        elif "pickled_result" in res:
+            res["result"] = unpickle_result(res.pop("pickled_result"))
+
         self.newest_responses[command].append(res)
         self.current_ids[command] = 0
 
@@ -166,6 +301,34 @@ class Client:
         if id != self.current_ids[command]:
             return
 
+    def load_shared_result(self, shared_result: SharedResult) -> Any:
+        """Reads a result from shared memory and lets the Server free it - internal API"""
+
+        name: str = shared_result["name"]
+        if name in self.loaded_shared_results:
+            # Already read for the request this one is a duplicate of
+            loaded, readers_left = self.loaded_shared_results.pop(name)
+            if readers_left > 1:
+                self.loaded_shared_results[name] = (loaded, readers_left - 1)
+            return loaded
+
+        result: Any = load_shared_result(shared_result)
+        if shared_result["readers"] > 1:
+            self.loaded_shared_results[name] = (
+                result,
+                shared_result["readers"] - 1,
+            )
+
+        free_request: Request = {
+            "id": 0,  # Never gets a response
+            "type": "request",
+            "command": "free-shared-result",
+        }
+        free_request.update(**{"name": name})
+        self.request_queue.put(free_request)
+
+        return result
+
     def check_responses(self) -> None:
         """Checks all main process output by calling parse_line() on each response - internal API"""
         while not self.response_queue.empty():
@@ -173,17 +336,21 @@ class Client:
 
     def get_response(self, command: str) -> Response | list[Response] | None:
         """Checks responses and returns the current response of type command if it has been returned - external API"""
-        if command not in self.commands:
+        if command not in self.commands and command not in BUILTIN_COMMANDS:
             raise CollegamentoError(
                 f"Cannot get response of command {command}, valid commands are {self.commands}"
             )
 
+        self.check_server()
         self.check_responses()
         response: list[Response] = self.newest_responses[command]
         self.newest_responses[command] = []
         if not len(response):
             return None
 
+        if command in BUILTIN_COMMANDS:
+            return response[-1]  # Only the newest is useful
+
         # If we know that the command doesn't allow multiple requests don't give a list
         if not self.commands[command][1]:
             return response[0]  # Will only ever be one
@@ -196,9 +363,9 @@ class Client:
         command: USER_FUNCTION,
         multiple_requests: bool = False,
     ) -> None:
-        if name == "add-command":
+        if name == "add-command" or name in BUILTIN_COMMANDS:
             raise CollegamentoError(
-                "Cannot add command add-command as it is a special builtin"
+                f"Cannot add command {name} as it is a special builtin"
             )
 
         id: int = self.create_message_id()
@@ -217,10 +384,73 @@ class Client:
         self.commands[name] = command_tuple
         self.newest_responses[name] = []
 
+    def request_builtin(self, command: str, **kwargs) -> None:
+        """Sends the Server a request for one of the BUILTIN_COMMANDS - internal API"""
+
+        final_request: Request = {
+            "id": self.create_message_id(),
+            "type": "request",
+            "command": command,
+        }
+        final_request.update(**kwargs)
+        self.request_queue.put(final_request)
+
+    def request_memory_report(self) -> None:
+        """Asks the Server how much memory its files and caches use, see get_response("memory-report") - external API"""
+
+        self.request_builtin("memory-report")
+
+    def request_stats(self) -> None:
+        """Asks the Server for its counters (like collapsed requests), see get_response("stats") - external API"""
+
+        self.request_builtin("stats")
+
+    def start_profiling(self) -> None:
+        """Starts profiling every command run by the Server - external API"""
+
+        self.request_builtin("profile", action="start")
+
+    def stop_profiling(self, limit: int = 30) -> None:
+        """Stops profiling once every request sent before this has run and asks for the profile
+        of each command, see get_response("profile") - external API"""
+
+        self.request_builtin("profile", action="stop", limit=limit)
+
+    def start_recording(self, trace_file: str) -> None:
+        """Writes every request from now on (with its timing) to the trace file, see replay_trace() - external API"""
+
+        self.stop_recording()
+        self.trace_recorder = TraceRecorder(trace_file)
+
+    def stop_recording(self) -> None:
+        """Stops recording requests and finishes the trace file - external API"""
+
+        if self.trace_recorder is None:
+            return
+
+        self.trace_recorder.close()
+        self.trace_recorder = None
+
     def kill_IPC(self):
         """Kills the internal Process and frees up some storage and CPU that may have been used otherwise - external API"""
         self.main_process.terminate()
 
+        if self.server_kwargs["large_result_threshold"] is None:
+            return
+
+        # Nobody will read these so their shared memory has to be freed now
+        freed: set[str] = set(self.loaded_shared_results)
+        while not self.response_queue.empty():
+            res: Response = self.response_queue.get()
+            if "shared_result" not in res:
+                continue
+
+            if res["shared_result"]["name"] in freed:
+                continue  # A duplicate of one we already freed
+
+            freed.add(res["shared_result"]["name"])
+            discard_shared_result(res["shared_result"])
+
     def __del__(self):
         # Multiprocessing bugs arise if the Process is created, not saved, and not terminated
         self.main_process.terminate()
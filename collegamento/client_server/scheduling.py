@@ -0,0 +1,38 @@
+"""Defines the SchedulingPolicy class which decides which pending request the Server runs next."""
+
+from .utils import Request
+
+
+class SchedulingPolicy:
+    """Gives every pending request a priority and the Server runs the highest one first (ties go to the oldest).
+
+    A request's priority is the one given to Client.request(command, request_priority=...) or its command's
+    weight (default_weight if it has none). Every second a request waits it gains aging_rate priority
+    so requests for low weight (bulk) commands can't be starved by a stream of high weight ones.
+    The default policy gives everything the same weight which just runs requests in the order they came.
+    """
+
+    def __init__(
+        self,
+        command_weights: dict[str, float] | None = None,
+        default_weight: float = 0,
+        aging_rate: float = 1,
+    ) -> None:
+        self.command_weights: dict[str, float] = command_weights or {}
+        self.default_weight: float = default_weight
+        self.aging_rate: float = aging_rate
+
+    def priority(self, request: Request, waited: float) -> float:
+        """The priority of a request that has been waiting for waited seconds"""
+
+        base_priority: float = request.get(  # type: ignore
+            "request_priority",
+            self.command_weights.get(request["command"], self.default_weight),
+        )
+        return base_priority + self.aging_rate * waited
+
+    def sort_key(self, request: Request, received: float) -> float:
+        """Sorts requests received at the given (monotonic) times from the highest priority to the
+        lowest. Every request ages at the same rate so this order never changes while they wait."""
+
+        return self.aging_rate * received - self.priority(request, 0.0)
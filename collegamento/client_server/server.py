@@ -1,16 +1,29 @@
 """Defines the Server class which is the butter to the bread that is the Client."""
 
-from time import sleep
-
-from beartype.typing import Any
-
+from asyncio import AbstractEventLoop, Task, new_event_loop
+from asyncio import sleep as async_sleep
+from cProfile import Profile
+from functools import partial
+from heapq import heappop, heappush
+from inspect import iscoroutinefunction
+from itertools import count
+from multiprocessing.shared_memory import SharedMemory
+from pstats import Stats
+from time import monotonic, perf_counter, sleep
+
+from beartype.typing import Any, Coroutine
+
+from .scheduling import SchedulingPolicy
+from .shared_results import keep_pickled_result, pickle_result, share_result
 from .utils import (
     USER_FUNCTION,
+    CommandProfile,
     Request,
     RequestQueueType,
     Response,
     ResponseQueueType,
 )
+from .watchdog import Heartbeat, run_command_steps
 
 
 def command_sort_func(
@@ -37,6 +50,10 @@ class Server:
         requests_queue: RequestQueueType,
         response_queue: ResponseQueueType,
         priority_commands: list[str] = [],  # Only used by subclasses
+        large_result_threshold: int | None = None,
+        deduplicate_commands: list[str] | None = None,
+        heartbeat: Heartbeat | None = None,
+        scheduling_policy: SchedulingPolicy | None = None,
     ) -> None:
         self.response_queue: ResponseQueueType = response_queue
         self.requests_queue: RequestQueueType = requests_queue
@@ -45,13 +62,66 @@ class Server:
         self.newest_requests: dict[str, list[Request]] = {}
         self.priority_commands: list[str] = priority_commands
 
+        # Picks the order of requests after the priority_commands
+        self.scheduling_policy: SchedulingPolicy = (
+            scheduling_policy or SchedulingPolicy()
+        )
+        # Pending requests ordered by (*command_sort_func(), sort_key, read order) which never
+        # changes as they wait. Handled or cancelled requests are skipped when popped.
+        self.request_heap: list[tuple[bool, int, float, int, Request]] = []
+        self.read_order = count()
+        # id -> read order of the pending request with that id (ids are reused)
+        self.read_orders: dict[int, int] = {}
+
+        # Results this big (in bytes) skip the pipe and go through shared memory
+        self.large_result_threshold: int | None = large_result_threshold
+        # Segments we keep mapped until the Client says it has read them
+        self.shared_segments: dict[str, SharedMemory] = {}
+
+        # Identical pending requests for these (multiple request) commands only run once
+        self.deduplicate_commands: list[str] = deduplicate_commands or []
+        # Total requests that were answered by another request's run
+        self.collapsed_requests: int = 0
+
+        # None unless the Client started profiling: command -> (Profile, calls, total time)
+        # (async commands only get calls and total time so their Profile is None)
+        self.profiles: dict[str, tuple[Profile | None, int, float]] | None = (
+            None
+        )
+        # (id, limit, ids it waits on) of a stop that waits for the requests read before it
+        # Profile starts and stops waiting to be run, each with the ids it waits on
+        # (a stop waits for the requests read before it, a start only for earlier stops)
+        self.profile_actions: list[tuple[Request, set[int]]] = []
+
+        # Made once the first async command is run
+        self.loop: AbstractEventLoop | None = None
+        # id -> (Task, request, duplicates, start time) for async commands still running
+        self.running_tasks: dict[
+            int, tuple[Task, Request, list[Request], float]
+        ] = {}
+        # Raised from the main loop like an error in a normal command would be
+        self.task_exception: BaseException | None = None
+
+        # Lets the Client's watchdog see that we're alive and what we're running
+        self.heartbeat: Heartbeat | None = heartbeat
+
         self.commands: dict[str, tuple[USER_FUNCTION, bool]] = commands
         for command, func_tuple in self.commands.items():
             self.newest_ids[command] = []
             self.newest_requests[command] = []
 
         while True:
+            if self.heartbeat is not None:
+                self.heartbeat.beat()
             self.run_tasks()
+
+            if self.running_tasks:
+                # Lets the async commands run instead of just sleeping
+                self.loop.run_until_complete(async_sleep(0.0025))  # type: ignore
+                if self.task_exception is not None:
+                    raise self.task_exception
+                continue
+
             sleep(0.0025)
 
     def simple_id_response(self, id: int, cancelled: bool = True) -> None:
@@ -62,6 +132,34 @@ class Server:
         }
         self.response_queue.put(response)
 
+    def builtin_response(self, id: int, command: str, result: Any) -> None:
+        response: Response = {
+            "id": id,
+            "type": "response",
+            "cancelled": False,
+            "command": command,
+            "result": result,
+        }
+        self.response_queue.put(response)
+
+    def memory_report(self) -> dict[str, Any]:
+        """How much the Server holds in memory: counts and byte sizes of its queues
+        and caches (subclasses add their own)"""
+
+        return {
+            "pending_requests": sum(
+                len(requests) for requests in self.newest_requests.values()
+            ),
+            "shared_result_bytes": sum(
+                segment.size for segment in self.shared_segments.values()
+            ),
+        }
+
+    def stats(self) -> dict[str, Any]:
+        """Counters of the work the Server did or saved (subclasses add their own)"""
+
+        return {"collapsed_requests": self.collapsed_requests}
+
     def parse_line(self, message: Request) -> None:
         id: int = message["id"]
 
@@ -76,14 +174,60 @@ class Server:
 
             request_tuple: tuple[USER_FUNCTION, bool] = message["function"]  # type: ignore
             self.commands[request_name] = request_tuple
+            # Requests still pending from an earlier read get cancelled responses
+            self.all_ids += [
+                old["id"]
+                for old in self.newest_requests.get(request_name, [])
+                if old["id"] not in self.all_ids
+            ]
             self.newest_requests[request_name] = []
             self.newest_ids[request_name] = []
             self.simple_id_response(id)
             return
 
+        if command == "memory-report":
+            self.builtin_response(id, command, self.memory_report())
+            return
+
+        if command == "stats":
+            self.builtin_response(id, command, self.stats())
+            return
+
+        if command == "profile":
+            waiting_on: set[int] = set()
+            if message["action"] == "stop":  # type: ignore
+                waiting_on = set(self.read_orders) | set(self.running_tasks)
+            self.profile_actions.append((message, waiting_on))
+            return
+
+        if command == "free-shared-result":
+            # Sent with id 0 and never gets a response
+            segment_name: str = message["name"]  # type: ignore
+            self.shared_segments.pop(segment_name).close()
+            return
+
         self.all_ids.append(id)
+        read_order: int = next(self.read_order)
+        self.read_orders[id] = read_order
+        heappush(
+            self.request_heap,
+            (
+                *command_sort_func(message, self.priority_commands),
+                self.scheduling_policy.sort_key(message, monotonic()),
+                read_order,
+                message,
+            ),
+        )
+        # Only meant for the Server so the command never sees it
+        message.pop("request_priority", None)  # type: ignore
 
         if not self.commands[command][1]:
+            # Requests still pending from an earlier read are replaced too
+            self.all_ids += [
+                old["id"]
+                for old in self.newest_requests[command]
+                if old["id"] not in self.all_ids
+            ]
             self.newest_ids[command] = []
             self.newest_requests[command] = []
 
@@ -91,21 +235,27 @@ class Server:
         self.newest_requests[command].append(message)
 
     def cancel_old_ids(self) -> None:
-        accepted_ids: list[int] = [
+        accepted_ids: set[int] = {
             request["id"]
             for request_list in list(self.newest_requests.values())
             for request in request_list
-        ]
+        }
 
         for request in self.all_ids:
             if request in accepted_ids:
                 continue
 
+            self.read_orders.pop(request, None)
             self.simple_id_response(request)
 
         self.all_ids = []
 
-    def handle_request(self, request: Request) -> None:
+    def handle_request(
+        self, request: Request, duplicates: list[Request] | None = None
+    ) -> None:
+        """Runs the request's command and sends the result to it and any duplicates of it"""
+
+        duplicates = duplicates or []
         command: str = request["command"]
         id: int = request["id"]
         result: Any  # noqa: F842
@@ -121,13 +271,224 @@ class Server:
         if command not in self.commands:
             response["result"] = None
             response["cancelled"] = True
+        elif iscoroutinefunction(self.commands[command][0]):
+            self.start_task(request, duplicates)
+            return
         else:
-            response["result"] = self.commands[command][0](self, request)
+            if self.heartbeat is not None:
+                self.heartbeat.start_command(command)
+            response["result"] = self.run_command(command, request)
+            if self.heartbeat is not None:
+                self.heartbeat.end_command()
 
-        self.response_queue.put(response)
-        self.newest_ids[command].remove(id)
+        self.send_responses(response, duplicates)
+
+    def send_responses(
+        self, response: Response, duplicates: list[Request]
+    ) -> None:
+        """Sends the response and a copy of it to each duplicate"""
+
+        command: str = response["command"]  # type: ignore
+        if self.large_result_threshold is not None:
+            # Shared once, every duplicate gets the same segment
+            self.share_large_result(response, len(duplicates) + 1)
+
+        responses: list[Response] = [response]
+        if duplicates:
+            response["collapsed_requests"] = len(duplicates) + 1
+            responses += [
+                response | {"id": duplicate["id"]}  # type: ignore
+                for duplicate in duplicates
+            ]
+            self.collapsed_requests += len(duplicates)
+
+        for sent in responses:
+            self.response_queue.put(sent)
+            if sent["id"] in self.newest_ids[command]:
+                # A newer request for an async command may have replaced it
+                self.newest_ids[command].remove(sent["id"])
+
+    def start_task(self, request: Request, duplicates: list[Request]) -> None:
+        """Runs an async command on the event loop, its response is sent once it finishes"""
+
+        command: str = request["command"]
+        if self.loop is None:
+            self.loop = new_event_loop()
+
+        if not self.commands[command][1]:
+            # Only the newest request matters so an older one still running is cancelled
+            for id, (task, old_request, old_duplicates, _) in list(
+                self.running_tasks.items()
+            ):
+                if old_request["command"] != command:
+                    continue
+
+                # A task that already finished can't be cancelled but its
+                # done callback sees that it's no longer running
+                task.cancel()
+                self.running_tasks.pop(id)
+                for old in [old_request, *old_duplicates]:
+                    self.simple_id_response(old["id"])
+
+        coroutine: Coroutine = self.commands[command][0](self, request)
+        if self.heartbeat is not None:
+            # So a coroutine that blocks the event loop counts as a hung command
+            coroutine = run_command_steps(self.heartbeat, command, coroutine)
+
+        task = self.loop.create_task(coroutine)
+        task.add_done_callback(partial(self.finish_task, request["id"]))
+        self.running_tasks[request["id"]] = (
+            task,
+            request,
+            duplicates,
+            perf_counter(),
+        )
+
+    def finish_task(self, id: int, task: Task) -> None:
+        if task.cancelled():
+            return  # The cancelled response was already sent
+
+        running: tuple[Task, Request, list[Request], float] | None = (
+            self.running_tasks.pop(id, None)
+        )
+        if running is None:
+            return  # Replaced by a newer request after it had already finished
+
+        _, request, duplicates, started = running
+        command: str = request["command"]
+
+        exception: BaseException | None = task.exception()
+        if exception is not None:
+            self.task_exception = exception
+            return
+
+        if self.profiles is not None:
+            # cProfile can't follow a coroutine between awaits so it's only timed
+            _, calls, total_time = self.profiles.get(command, (None, 0, 0.0))
+            self.profiles[command] = (
+                None,
+                calls + 1,
+                total_time + perf_counter() - started,
+            )
+
+        response: Response = {
+            "id": id,
+            "type": "response",
+            "cancelled": False,
+            "command": command,
+            "result": task.result(),
+        }
+        self.send_responses(response, duplicates)
+
+    def run_command(self, command: str, request: Request) -> Any:
+        """Calls the command's function, under a profiler if profiling was started"""
+
+        if self.profiles is None:
+            return self.commands[command][0](self, request)
+
+        profiler, calls, total_time = self.profiles.get(
+            command, (Profile(), 0, 0.0)
+        )
+        profiler = profiler or Profile()  # It was async before being replaced
+        start: float = perf_counter()
+        result: Any = profiler.runcall(
+            self.commands[command][0], self, request
+        )
+        self.profiles[command] = (
+            profiler,
+            calls + 1,
+            total_time + perf_counter() - start,
+        )
+        return result
+
+    def check_profile_actions(self) -> None:
+        """Runs the profile starts and stops in the order they were read,
+        a stop only once every request read before it has run"""
+
+        while self.profile_actions:
+            message, waiting_on = self.profile_actions[0]
+            if any(
+                waiting in self.read_orders or waiting in self.running_tasks
+                for waiting in waiting_on
+            ):
+                return
+
+            self.profile_actions.pop(0)
+            if message["action"] == "start":  # type: ignore
+                self.profiles = {}
+                self.simple_id_response(message["id"], False)
+                continue
+
+            profile_limit: int = message["limit"]  # type: ignore
+            self.builtin_response(
+                message["id"], "profile", self.profile_report(profile_limit)
+            )
+            self.profiles = None
+
+    def profile_report(self, limit: int) -> dict[str, CommandProfile]:
+        """Aggregates the profiles of each command, keeping the limit slowest functions (by cumulative time)"""
+
+        report: dict[str, CommandProfile] = {}
+        for command, (profiler, calls, total_time) in (
+            self.profiles or {}
+        ).items():
+            stats: dict[Any, Any] = {}
+            if profiler is not None:
+                stats = Stats(profiler).stats  # type: ignore
+            # (primitive calls, calls, own time, cumulative time, callers)
+            functions: list[tuple[str, int, str, int, float, float]] = [
+                (filename, line, function, stat[1], stat[2], stat[3])
+                for (filename, line, function), stat in stats.items()
+            ]
+            functions.sort(key=lambda function: function[5], reverse=True)
+            report[command] = {
+                "calls": calls,
+                "total_time": total_time,
+                "functions": functions[:limit],
+            }
+
+        return report
+
+    def find_duplicates(self, request: Request) -> list[Request]:
+        """Gives the other pending requests that only differ from this one by id"""
+
+        command: str = request["command"]
+        if (
+            command not in self.deduplicate_commands
+            or not self.commands[command][1]
+        ):
+            return []
+
+        request_args: dict[str, Any] = {
+            key: value for key, value in request.items() if key != "id"
+        }
+        return [
+            other
+            for other in self.newest_requests[command]
+            if other is not request
+            and {key: value for key, value in other.items() if key != "id"}
+            == request_args
+        ]
+
+    def share_large_result(self, response: Response, readers: int) -> None:
+        """Moves the result into shared memory if it's over the threshold"""
+
+        threshold: int = self.large_result_threshold  # type: ignore
+        data, raw_buffers = pickle_result(response["result"])
+        response["result"] = None
+
+        if len(data) + sum(raw.nbytes for raw in raw_buffers) < threshold:
+            # Sent as the bytes we measured so the Queue doesn't pickle it again
+            response["pickled_result"] = keep_pickled_result(data, raw_buffers)
+            return
+
+        segment, shared_result = share_result(data, raw_buffers, readers)
+        self.shared_segments[segment.name] = segment
+        response["shared_result"] = shared_result
+
+    def read_requests(self) -> None:
+        """Reads every new request and cancels the ones that were replaced"""
 
-    def run_tasks(self) -> None:
         if self.requests_queue.empty():
             return
 
@@ -136,23 +497,33 @@ class Server:
 
         self.cancel_old_ids()
 
-        requests_list: list[Request] = [
-            request
-            for request_list in self.newest_requests.values()
-            if request_list
-            for request in request_list
-        ]
+    def next_request(self) -> Request | None:
+        """Gives the pending request to run next: priority_commands first and
+        then the highest priority given by the scheduling_policy"""
 
-        requests_list = sorted(
-            requests_list,
-            key=lambda request: command_sort_func(
-                request, self.priority_commands
-            ),
-        )
+        while self.request_heap:
+            *_, read_order, request = heappop(self.request_heap)
+            if self.read_orders.get(request["id"]) == read_order:
+                return request
+
+        return None
+
+    def run_tasks(self) -> None:
+        """Runs requests until none are pending, reading new ones after each so a
+        high priority request doesn't have to wait for everything read before it"""
 
-        for request in requests_list:
+        while True:
+            self.read_requests()
+            self.check_profile_actions()
+
+            request: Request | None = self.next_request()
             if request is None:
-                continue
+                return
+
             command: str = request["command"]
-            self.handle_request(request)
-            self.newest_requests[command].remove(request)
+            duplicates: list[Request] = self.find_duplicates(request)
+            self.handle_request(request, duplicates)
+
+            for handled in [request, *duplicates]:
+                self.newest_requests[command].remove(handled)
+                self.read_orders.pop(handled["id"])
@@ -0,0 +1,97 @@
+"""Moves large command results through shared memory instead of pickling them through the response Queue's pipe."""
+
+from multiprocessing.shared_memory import SharedMemory
+from pickle import PickleBuffer, dumps, loads
+
+from beartype.typing import Any
+
+from .utils import PickledResult, SharedResult
+
+
+def pickle_result(result: Any) -> tuple[bytes, list[memoryview]]:
+    """Pickles the result and gives its in band data and raw out of band buffers - internal API
+
+    Pickle protocol 5 hands out of band buffers (NumPy arrays, PickleBuffer's) to us directly so they
+    aren't copied into the data. The caller has to release the buffers."""
+
+    buffers: list[PickleBuffer] = []
+    data: bytes = dumps(result, protocol=5, buffer_callback=buffers.append)
+    return (data, [buffer.raw() for buffer in buffers])
+
+
+def keep_pickled_result(
+    data: bytes, raw_buffers: list[memoryview]
+) -> PickledResult:
+    """Copies a small pickle_result() into bytes that go through the Queue as is - internal API"""
+
+    pickled: PickledResult = (data, [raw.tobytes() for raw in raw_buffers])
+    for raw in raw_buffers:
+        raw.release()
+    return pickled
+
+
+def unpickle_result(pickled: PickledResult) -> Any:
+    """Rebuilds a result made by keep_pickled_result() - internal API"""
+
+    data, buffers = pickled
+    return loads(data, buffers=buffers)
+
+
+def share_result(
+    data: bytes, raw_buffers: list[memoryview], readers: int = 1
+) -> tuple[SharedMemory, SharedResult]:
+    """Copies a pickle_result() into a new shared memory segment - internal API
+
+    The out of band buffers are copied once into the segment instead of being pickled into the
+    stream. readers is how many Response's (a request and its duplicates) share the segment."""
+
+    buffer_sizes: list[int] = [raw.nbytes for raw in raw_buffers]
+    total_size: int = len(data) + sum(buffer_sizes)
+
+    segment = SharedMemory(create=True, size=max(total_size, 1))
+    offset: int = len(data)
+    segment.buf[:offset] = data
+    for raw in raw_buffers:
+        segment.buf[offset : offset + raw.nbytes] = raw
+        offset += raw.nbytes
+        raw.release()
+
+    shared_result: SharedResult = {
+        "name": segment.name,
+        "data_size": len(data),
+        "buffer_sizes": buffer_sizes,
+        "readers": readers,
+    }
+    return (segment, shared_result)
+
+
+def load_shared_result(shared_result: SharedResult) -> Any:
+    """Rebuilds a result shared by share_result() and unlinks its segment - internal API
+
+    The Server still has the segment mapped until it is told to free it (Windows frees a
+    segment once nobody has it open so the Server can't close it early)."""
+
+    segment = SharedMemory(shared_result["name"])
+
+    offset: int = shared_result["data_size"]
+    buffers: list[bytearray] = []
+    for size in shared_result["buffer_sizes"]:
+        # Copied out so the result doesn't keep the segment alive
+        with segment.buf[offset : offset + size] as view:
+            buffers.append(bytearray(view))
+        offset += size
+
+    with segment.buf[: shared_result["data_size"]] as data:
+        result: Any = loads(data, buffers=buffers)
+
+    segment.close()
+    segment.unlink()
+    return result
+
+
+def discard_shared_result(shared_result: SharedResult) -> None:
+    """Unlinks a segment whose result will never be read - internal API"""
+
+    segment = SharedMemory(shared_result["name"])
+    segment.close()
+    segment.unlink()
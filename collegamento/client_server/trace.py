@@ -0,0 +1,46 @@
+"""Records the requests a Client makes to a compact trace file so they can be replayed later."""
+
+from gzip import GzipFile
+from pickle import UnpicklingError, dump, load
+from time import perf_counter, time
+
+from beartype.typing import Any
+
+TRACE_VERSION: int = 1
+
+# (seconds since recording started, command, kwargs)
+TRACE_RECORD = tuple[float, str, dict[str, Any]]
+
+
+class TraceRecorder:
+    """Appends every request to a gzipped stream of pickles, the first of which is a header"""
+
+    def __init__(self, trace_file: str) -> None:
+        self.file: GzipFile = GzipFile(trace_file, "wb")
+        self.start: float = perf_counter()
+
+        header: dict[str, Any] = {"version": TRACE_VERSION, "started": time()}
+        dump(header, self.file, protocol=5)
+
+    def record(self, command: str, kwargs: dict[str, Any]) -> None:
+        record: TRACE_RECORD = (perf_counter() - self.start, command, kwargs)
+        dump(record, self.file, protocol=5)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def read_trace(trace_file: str) -> tuple[dict[str, Any], list[TRACE_RECORD]]:
+    """Gives the header and records of a trace, ignoring a cut off end (the recording Client was killed)"""
+
+    records: list[TRACE_RECORD] = []
+    with GzipFile(trace_file, "rb") as file:
+        header: dict[str, Any] = load(file)
+
+        while True:
+            try:
+                records.append(load(file))
+            except (EOFError, UnpicklingError):
+                break
+
+    return (header, records)
@@ -16,6 +16,20 @@ class Request(Message):
     """Request from the IPC class to the server with command specific input"""
 
     command: str
+    request_priority: NotRequired[float]  # Overrides the command's weight
+
+
+class SharedResult(TypedDict):
+    """Where a large result was put in shared memory and how to unpickle it"""
+
+    name: str
+    data_size: int  # The in band pickle data comes first
+    buffer_sizes: list[int]  # Followed by each out of band buffer
+    readers: int  # Response's sharing this segment (duplicates share one)
+
+
+# In band pickle data and out of band buffers of a result that was already pickled
+PickledResult = tuple[bytes, list[bytes]]
 
 
 class Response(Message):
@@ -24,11 +38,35 @@ class Response(Message):
     cancelled: bool
     command: NotRequired[str]
     result: NotRequired[Any]
+    shared_result: NotRequired[SharedResult]  # Never given to the user
+    pickled_result: NotRequired[PickledResult]  # Never given to the user
+    collapsed_requests: NotRequired[int]  # Identical requests sharing this run
+
+
+class CommandProfile(TypedDict):
+    """What the Server profiled for a single command"""
+
+    calls: int
+    total_time: float  # Seconds spent in the command
+    # (filename, line, function, calls, own time, cumulative time) slowest first
+    functions: list[tuple[str, int, str, int, float, float]]
+
+
+class WatchdogEvent(TypedDict):
+    """Given when the Client's watchdog restarts the Server"""
+
+    type: str  # Can be "hung" or "dead"
+    command: str | None  # The command the Server was stuck in
+    elapsed: float  # Seconds stuck in the command or since the last heartbeat
+    time: float  # time.time() of the restart
 
 
 class CollegamentoError(Exception): ...  # I don't like the boilerplate either
 
 
+# Handled by the Server itself and answered with a Response the Client keeps
+BUILTIN_COMMANDS: list[str] = ["memory-report", "profile", "stats"]
+
 USER_FUNCTION = Callable[["Server", Request], Any]  # type: ignore
 COMMANDS_MAPPING = dict[
     str, USER_FUNCTION | tuple[USER_FUNCTION, bool]
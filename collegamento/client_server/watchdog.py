@@ -0,0 +1,83 @@
+"""Defines the Heartbeat the Server writes to so the Client can tell if it is dead or stuck in a command."""
+
+from multiprocessing.sharedctypes import RawArray
+from time import monotonic
+
+from beartype.typing import Any, Coroutine, Generator
+
+# The Server beats every loop (and after every command) so a beat this old
+# means it may be dead and is worth checking on
+HEARTBEAT_TIMEOUT: float = 0.05
+
+
+class Heartbeat:
+    """Lock free shared memory written by the Server and read by the Client (reading
+    and writing are just memory accesses so it's cheap enough to check on every request)"""
+
+    def __init__(self) -> None:
+        # [time of the last beat, time the current command started or 0.0 if idle]
+        self.times = RawArray("d", 2)
+        self.command = RawArray("c", 128)  # Name of the current command
+
+    def beat(self) -> None:
+        self.times[0] = monotonic()
+
+    def start_command(self, command: str) -> None:
+        self.command.value = command.encode()[:127]
+        self.times[1] = monotonic()
+
+    def end_command(self) -> None:
+        self.times[1] = 0.0
+        self.beat()
+
+    @property
+    def last_beat(self) -> float:
+        return self.times[0]
+
+    @property
+    def command_started(self) -> float:
+        return self.times[1]
+
+    @property
+    def current_command(self) -> str:
+        return self.command.value.decode(errors="replace")
+
+
+class CommandSteps:
+    """Awaits an async command's coroutine and marks the command as running on the Heartbeat
+    during each of its steps so a coroutine that blocks the event loop is caught like a hung command"""
+
+    def __init__(
+        self, heartbeat: Heartbeat, command: str, coroutine: Coroutine
+    ) -> None:
+        self.heartbeat: Heartbeat = heartbeat
+        self.command: str = command
+        self.coroutine: Coroutine = coroutine
+
+    def __await__(self) -> Generator[Any, Any, Any]:
+        value: Any = None
+        error: BaseException | None = None
+
+        while True:
+            self.heartbeat.start_command(self.command)
+            try:
+                if error is None:
+                    awaited: Any = self.coroutine.send(value)
+                else:
+                    awaited = self.coroutine.throw(error)
+            except StopIteration as finished:
+                return finished.value
+            finally:
+                self.heartbeat.end_command()
+
+            # Whatever the coroutine waits on is handed to the event loop as is
+            try:
+                value, error = (yield awaited), None
+            except BaseException as thrown:  # Such as a cancellation
+                value, error = None, thrown
+
+
+async def run_command_steps(
+    heartbeat: Heartbeat, command: str, coroutine: Coroutine
+) -> Any:
+    return await CommandSteps(heartbeat, command, coroutine)
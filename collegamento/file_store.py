@@ -0,0 +1,169 @@
+"""Defines the FileStore class which keeps files in memory until they go over a memory budget."""
+
+from sys import getsizeof
+from tempfile import TemporaryFile
+from zlib import compress, decompress
+
+from beartype.typing import IO, Any, Iterator, MutableMapping
+
+
+def object_size(obj: Any) -> int:
+    """Rough deep size of an object in bytes that follows builtin containers"""
+
+    seen: set[int] = set()
+    to_check: list[Any] = [obj]
+    size: int = 0
+
+    while to_check:
+        current: Any = to_check.pop()
+        if id(current) in seen:
+            continue
+        seen.add(id(current))
+
+        size += getsizeof(current)
+        if isinstance(current, dict):
+            to_check.extend(current.keys())
+            to_check.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset)):
+            to_check.extend(current)
+
+    return size
+
+
+class FileStore(MutableMapping[str, str]):
+    """A dict of file names to contents that moves the least recently used files to a compressed
+    temporary file when the files in memory go over memory_budget bytes (None means no budget).
+    Spilled files are brought back into memory whenever they are accessed."""
+
+    def __init__(self, memory_budget: int | None = None) -> None:
+        self.memory_budget: int | None = memory_budget
+        self.memory_bytes: int = 0
+
+        # Ordered from least to most recently used
+        self.in_memory: dict[str, str] = {}
+        # file -> (offset, length) in the spill file
+        self.spilled: dict[str, tuple[int, int]] = {}
+        self.spill_file: IO[bytes] | None = None
+        self.spilled_bytes: int = 0
+        self.dead_bytes: int = 0  # Left behind by files that were restored
+
+    def __getitem__(self, file: str) -> str:
+        if file in self.spilled:
+            contents: str = self.restore(file)
+        else:
+            contents = self.in_memory.pop(file)
+
+        self.in_memory[file] = contents  # Now the most recently used
+        self.enforce_budget()
+        return contents
+
+    def __setitem__(self, file: str, contents: str) -> None:
+        self.discard(file)
+
+        self.in_memory[file] = contents
+        self.memory_bytes += getsizeof(contents)
+        self.enforce_budget()
+
+    def __delitem__(self, file: str) -> None:
+        if file not in self:
+            raise KeyError(file)
+
+        self.discard(file)
+
+    def __iter__(self) -> Iterator[str]:
+        yield from list(self.spilled)
+        yield from list(self.in_memory)
+
+    def __len__(self) -> int:
+        return len(self.in_memory) + len(self.spilled)
+
+    def __contains__(self, file: object) -> bool:
+        return file in self.in_memory or file in self.spilled
+
+    def discard(self, file: str) -> None:
+        if file in self.in_memory:
+            self.memory_bytes -= getsizeof(self.in_memory.pop(file))
+            return
+
+        if file in self.spilled:
+            length: int = self.spilled.pop(file)[1]
+            self.spilled_bytes -= length
+            self.dead_bytes += length
+
+    def enforce_budget(
+        self, extra_bytes: dict[str, int] | None = None
+    ) -> list[str]:
+        """Spills the least recently used files until the files fit the budget and returns the
+        spilled files. extra_bytes gives the bytes of caches kept by the owner for each file which
+        count towards the budget until their file is spilled (the owner should drop them then).
+        The most recently used file always stays in memory."""
+
+        if self.memory_budget is None:
+            return []
+
+        extra_bytes = extra_bytes or {}
+        total_extra: int = sum(extra_bytes.values())
+
+        spilled_files: list[str] = []
+        while (
+            self.memory_bytes + total_extra > self.memory_budget
+            and len(self.in_memory) > 1
+        ):
+            file: str = next(iter(self.in_memory))
+            self.spill(file)
+            total_extra -= extra_bytes.get(file, 0)
+            spilled_files.append(file)
+
+        return spilled_files
+
+    def spill(self, file: str) -> None:
+        contents: str = self.in_memory.pop(file)
+        self.memory_bytes -= getsizeof(contents)
+
+        if self.spill_file is None:
+            # Deleted by the OS once closed, even if the process is killed
+            self.spill_file = TemporaryFile()
+
+        data: bytes = compress(contents.encode("utf-8", "surrogatepass"), 1)
+        offset: int = self.spill_file.seek(0, 2)
+        self.spill_file.write(data)
+        self.spilled[file] = (offset, len(data))
+        self.spilled_bytes += len(data)
+
+    def restore(self, file: str) -> str:
+        offset, length = self.spilled.pop(file)
+        self.spill_file.seek(offset)  # type: ignore
+        data: bytes = self.spill_file.read(length)  # type: ignore
+        contents: str = decompress(data).decode("utf-8", "surrogatepass")
+
+        self.spilled_bytes -= length
+        self.dead_bytes += length
+        self.memory_bytes += getsizeof(contents)
+
+        if self.dead_bytes > max(self.spilled_bytes, 1_000_000):
+            self.compact()
+
+        return contents
+
+    def compact(self) -> None:
+        """Rewrites the spill file without the space used by restored or removed files"""
+
+        old_file: IO[bytes] = self.spill_file  # type: ignore
+        self.spill_file = TemporaryFile()
+
+        for file, (offset, length) in list(self.spilled.items()):
+            old_file.seek(offset)
+            self.spilled[file] = (self.spill_file.tell(), length)
+            self.spill_file.write(old_file.read(length))
+
+        old_file.close()
+        self.dead_bytes = 0
+
+    def memory_report(self) -> dict[str, int | None]:
+        return {
+            "memory_budget": self.memory_budget,
+            "files_in_memory": len(self.in_memory),
+            "memory_bytes": self.memory_bytes,
+            "files_spilled": len(self.spilled),
+            "spilled_bytes": self.spilled_bytes,
+        }
@@ -1,5 +1,7 @@
 from typing import NotRequired
 
+from beartype.typing import Any, Callable, Iterator, Mapping
+
 from .client_server import (
     COMMANDS_MAPPING,
     USER_FUNCTION,
@@ -8,13 +10,36 @@ from .client_server import (
     Request,
     RequestQueueType,
     ResponseQueueType,
+    SchedulingPolicy,
     Server,
 )
+from .file_store import FileStore, object_size
 
 
 class FileRequest(Request):
     # There may be commands that don't require a file but some might
     file: NotRequired[str]
+    file_indexes: NotRequired["FileIndexes"]
+
+
+FILE_HOOK = Callable[["FileServer", str, str], Any]  # (server, file, contents)
+
+
+class FileIndexes(Mapping[str, Any]):
+    """Read only view of the hook results for a file that only runs a hook once it is accessed"""
+
+    def __init__(self, server: "FileServer", file: str) -> None:
+        self.server: "FileServer" = server
+        self.file: str = file
+
+    def __getitem__(self, hook: str) -> Any:
+        return self.server.get_file_index(self.file, hook)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.server.file_hooks)
+
+    def __len__(self) -> int:
+        return len(self.server.file_hooks)
 
 
 def update_files(server: "FileServer", request: Request) -> None:
@@ -22,32 +47,77 @@ def update_files(server: "FileServer", request: Request) -> None:
 
     if request["remove"]:  # type: ignore
         server.files.pop(file)
+        server.drop_file_indexes(file)
         return
 
     contents: str = request["contents"]  # type: ignore
+    if server.files.get(file) == contents:
+        return  # Nothing changed so the old indexes are still valid
+
     server.files[file] = contents
+    server.drop_file_indexes(file)
+
+
+def add_file_hook(server: "FileServer", request: Request) -> None:
+    name: str = request["name"]  # type: ignore
+    server.file_hooks[name] = request["hook"]  # type: ignore
+
+    # Anything made by an older hook of the same name is now stale
+    for file in list(server.file_indexes):
+        server.drop_file_indexes(file, name)
 
 
 class FileClient(Client):
     """File handling variant of SImpleClient. Extra methods:
     - FileClient.update_file()
     - FileClient.remove_file()
+    - FileClient.add_file_hook()
+
+    Files over the memory_budget (in bytes) are spilled to disk on both sides.
     """
 
     def __init__(
-        self, commands: COMMANDS_MAPPING, id_max: int = 15_000
+        self,
+        commands: COMMANDS_MAPPING,
+        id_max: int = 15_000,
+        file_hooks: dict[str, FILE_HOOK] | None = None,
+        large_result_threshold: int | None = None,
+        deduplicate_commands: list[str] | None = None,
+        memory_budget: int | None = None,
+        hang_thresholds: dict[str, float] | None = None,
+        default_hang_threshold: float | None = None,
+        scheduling_policy: SchedulingPolicy | None = None,
     ) -> None:
-        self.files: dict[str, str] = {}
+        # Files over the budget are spilled to disk here and on the FileServer
+        self.files: FileStore = FileStore(memory_budget)
+        self.file_hooks: dict[str, FILE_HOOK] = {}
 
         commands["FileNotification"] = (update_files, True)
+        commands["FileHookNotification"] = (add_file_hook, True)
+
+        super().__init__(
+            commands,
+            id_max,
+            FileServer,
+            large_result_threshold=large_result_threshold,
+            deduplicate_commands=deduplicate_commands,
+            hang_thresholds=hang_thresholds,
+            default_hang_threshold=default_hang_threshold,
+            scheduling_policy=scheduling_policy,
+            server_kwargs={"memory_budget": memory_budget},
+        )
 
-        super().__init__(commands, id_max, FileServer)
+        for name, hook in (file_hooks or {}).items():
+            self.add_file_hook(name, hook)
 
     def create_server(self) -> None:
         """Creates the main_server through a subprocess - internal API"""
 
         super().create_server()
 
+        for name, hook in self.file_hooks.items():
+            self.add_file_hook(name, hook)
+
         for file, data in self.files.items():
             self.update_file(file, data)
 
@@ -79,8 +149,16 @@ class FileClient(Client):
                 f"Cannot remove file {file} as file is not in file database!"
             )
 
+        self.files.pop(file)
         super().request("FileNotification", file=file, remove=True)
 
+    def add_file_hook(self, name: str, hook: FILE_HOOK) -> None:
+        """Adds or replaces an on file changed hook whose result is given to commands - external API"""
+
+        self.file_hooks[name] = hook
+
+        super().request("FileHookNotification", name=name, hook=hook)
+
 
 class FileServer(Server):
     """File handling variant of SimpleServer"""
@@ -90,18 +168,79 @@ class FileServer(Server):
         commands: dict[str, tuple[USER_FUNCTION, bool]],
         requests_queue: RequestQueueType,
         response_queue: ResponseQueueType,
+        memory_budget: int | None = None,
+        **kwargs: Any,  # Passed on to the Server
     ) -> None:
-        self.files: dict[str, str] = {}
+        self.files: FileStore = FileStore(memory_budget)
+        self.file_hooks: dict[str, FILE_HOOK] = {}
+        # file -> hook name -> hook result, dropped whenever the file changes
+        self.file_indexes: dict[str, dict[str, Any]] = {}
+        self.file_index_bytes: dict[str, int] = {}  # Only kept with a budget
 
         super().__init__(
             commands,
             requests_queue,
             response_queue,
-            ["FileNotification"],
+            ["FileNotification", "FileHookNotification"],
+            **kwargs,
         )
 
-    def handle_request(self, request: Request) -> None:
+    def get_file_index(self, file: str, hook: str) -> Any:
+        """Runs the hook on the file only if it hasn't been run since the file last changed"""
+
+        indexes: dict[str, Any] = self.file_indexes.setdefault(file, {})
+        if hook not in indexes:
+            indexes[hook] = self.file_hooks[hook](self, file, self.files[file])
+
+            if self.files.memory_budget is not None:
+                index_bytes: int = object_size(indexes[hook])
+                self.file_index_bytes.setdefault(file, 0)
+                self.file_index_bytes[file] += index_bytes
+
+        return indexes[hook]
+
+    def drop_file_indexes(self, file: str, hook: str | None = None) -> None:
+        """Drops the file's result for the hook (or all hooks if it's None)"""
+
+        indexes: dict[str, Any] | None = self.file_indexes.get(file)
+        if indexes is None or (hook is not None and hook not in indexes):
+            return
+
+        if hook is not None and len(indexes) > 1:
+            indexes.pop(hook)
+            if file in self.file_index_bytes:
+                self.file_index_bytes[file] = object_size(indexes)
+            return
+
+        self.file_indexes.pop(file)
+        self.file_index_bytes.pop(file, None)
+
+    def enforce_memory_budget(self) -> None:
+        """Spills idle files (and drops their indexes) if the files and indexes are over budget"""
+
+        if self.files.memory_budget is None:
+            return
+
+        # Each spilled file's indexes stop counting as they're dropped below
+        self.files.enforce_budget(self.file_index_bytes)
+
+        for file in list(self.file_indexes):
+            if file not in self.files.in_memory:
+                self.drop_file_indexes(file)
+
+    def memory_report(self) -> dict[str, Any]:
+        report: dict[str, Any] = super().memory_report()
+        report.update(self.files.memory_report())
+        report["file_index_bytes"] = object_size(self.file_indexes)
+        return report
+
+    def handle_request(
+        self, request: Request, duplicates: list[Request] | None = None
+    ) -> None:
         if "file" in request and request["command"] != "FileNotification":
-            request["file"] = self.files[request["file"]]
+            file: str = request["file"]  # type: ignore
+            request["file"] = self.files[file]
+            request["file_indexes"] = FileIndexes(self, file)  # type: ignore
 
-        super().handle_request(request)
+        super().handle_request(request, duplicates)
+        self.enforce_memory_budget()
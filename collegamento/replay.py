@@ -0,0 +1,188 @@
+"""Replays a trace recorded with Client.start_recording() against a new Client and measures latencies.
+
+Can also be used from the command line where the factory is an importable function that makes the Client:
+python -m collegamento.replay trace.gz my_module:make_client --speed 10
+"""
+
+from argparse import ArgumentParser
+from importlib import import_module
+from math import ceil
+from time import perf_counter, sleep
+from typing import TypedDict
+
+from beartype.typing import Any
+
+from .client_server import Client, Response
+from .client_server.trace import TRACE_RECORD, read_trace
+from .files_variant import FileClient
+
+
+class LatencyStats(TypedDict):
+    """Latencies (in seconds) from sending a request to getting its response"""
+
+    requests: int
+    answered: int
+    cancelled: int  # Replaced by a newer request before being run
+    p50: float
+    p90: float
+    p99: float
+    max: float
+
+
+def percentile(sorted_values: list[float], percent: int) -> float:
+    """Nearest rank percentile, 0.0 if there are no values"""
+
+    if not sorted_values:
+        return 0.0
+
+    rank: int = ceil(percent / 100 * len(sorted_values))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def send_record(client: Client, record: TRACE_RECORD) -> int:
+    """Sends the recorded request and gives its id"""
+
+    _, command, kwargs = record
+
+    if isinstance(client, FileClient) and command == "FileNotification":
+        # These go through the FileClient so its files match the FileServer's
+        if kwargs["remove"]:
+            client.remove_file(kwargs["file"])
+        else:
+            client.update_file(kwargs["file"], kwargs["contents"])
+    elif isinstance(client, FileClient) and command == "FileHookNotification":
+        client.add_file_hook(kwargs["name"], kwargs["hook"])
+    else:
+        client.request(command, **kwargs)
+
+    return client.current_ids[command]  # type: ignore
+
+
+def replay_trace(
+    trace_file: str,
+    client: Client,
+    speed: float | None = 1.0,
+    timeout: float = 30.0,
+) -> dict[str, LatencyStats]:
+    """Sends every request in the trace to the client's Server with the recorded timing
+    divided by speed (None sends them as fast as possible) and gives the latency stats of
+    each command and of all of them ("all"). Waits up to timeout seconds for the last responses.
+
+    The Client must have been made with the same commands as the one that was recorded."""
+
+    records: list[TRACE_RECORD] = read_trace(trace_file)[1]
+
+    sent_at: dict[int, tuple[str, float]] = {}  # id -> (command, time sent)
+    # command -> latencies of answered requests and the number cancelled
+    latencies: dict[str, list[float]] = {}
+    cancelled: dict[str, int] = {}
+
+    def check_responses() -> None:
+        while not client.response_queue.empty():
+            res: Response = client.response_queue.get()
+            received: float = perf_counter()
+            client.parse_response(res)
+
+            if res["id"] not in sent_at:
+                continue
+
+            command, sent = sent_at.pop(res["id"])
+            if res["cancelled"]:
+                cancelled[command] += 1
+                continue
+            latencies[command].append(received - sent)
+
+    start: float = perf_counter()
+    for record in records:
+        if speed is not None:
+            send_time: float = start + record[0] / speed
+            while perf_counter() < send_time:
+                check_responses()
+                sleep(min(0.001, max(send_time - perf_counter(), 0)))
+
+        command: str = record[1]
+        latencies.setdefault(command, [])
+        cancelled.setdefault(command, 0)
+        sent_at[send_record(client, record)] = (command, perf_counter())
+
+    give_up: float = perf_counter() + timeout
+    while sent_at and perf_counter() < give_up:
+        check_responses()
+        sleep(0.001)
+
+    report: dict[str, LatencyStats] = {}
+    requests: dict[str, int] = {
+        command: len(times) + cancelled[command]
+        for command, times in latencies.items()
+    }
+    for _, command in sent_at.values():  # Never answered
+        requests[command] += 1
+
+    latencies["all"] = [
+        latency for times in latencies.values() for latency in times
+    ]
+    cancelled["all"] = sum(cancelled.values())
+    requests["all"] = sum(requests.values())
+
+    for command, times in latencies.items():
+        times.sort()
+        report[command] = {
+            "requests": requests[command],
+            "answered": len(times),
+            "cancelled": cancelled[command],
+            "p50": percentile(times, 50),
+            "p90": percentile(times, 90),
+            "p99": percentile(times, 99),
+            "max": times[-1] if times else 0.0,
+        }
+
+    return report
+
+
+def main() -> None:
+    parser = ArgumentParser(
+        prog="python -m collegamento.replay",
+        description="Replays a trace recorded with Client.start_recording()",
+    )
+    parser.add_argument("trace_file")
+    parser.add_argument(
+        "client_factory",
+        help="module:function that takes no arguments and gives a Client",
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="how many times faster than recorded (0 means no waiting)",
+    )
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    module_name, function_name = args.client_factory.split(":")
+    client: Client = getattr(import_module(module_name), function_name)()
+
+    report: dict[str, LatencyStats] = replay_trace(
+        args.trace_file,
+        client,
+        args.speed or None,
+        args.timeout,
+    )
+    client.kill_IPC()
+
+    print(
+        f"{'command':<24}{'requests':>10}{'cancelled':>10}"
+        f"{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    )
+    for command, stats in report.items():
+        times: list[Any] = [
+            stats[key] * 1000  # type: ignore
+            for key in ("p50", "p90", "p99", "max")
+        ]
+        print(
+            f"{command:<24}{stats['requests']:>10}{stats['cancelled']:>10}"
+            + "".join(f"{time:>10.2f}" for time in times)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
+from sys import getsizeof
 from time import sleep
 
-from collegamento import FileClient, FileServer, Request, Response
+from collegamento import FileClient, FileServer, FileStore, Request, Response
+from collegamento.file_store import object_size
 
 
 def func(server: FileServer, request: Request) -> bool:
@@ -12,6 +14,15 @@ def split_str(server: FileServer, arg: Request) -> list[str]:
     return file.split(" ")
 
 
+def count_words(server: FileServer, file: str, contents: str) -> int:
+    server.hook_runs = getattr(server, "hook_runs", 0) + 1  # type: ignore
+    return len(contents.split(" "))
+
+
+def word_count(server: FileServer, arg: Request) -> tuple[int, int]:
+    return (arg["file_indexes"]["words"], server.hook_runs)  # type: ignore
+
+
 def test_file_variants():
     context = FileClient({"test": func})
 
@@ -43,5 +54,118 @@ def test_file_variants():
     context.kill_IPC()
 
 
+def test_file_hooks():
+    context = FileClient(
+        {"word_count": (word_count, True)}, file_hooks={"words": count_words}
+    )
+
+    context.update_file("test", "one two three")
+    context.request("word_count", file="test")
+    context.request("word_count", file="test")
+    sleep(0.5)
+    context.update_file("test", "one two three")  # Unchanged, no rerun
+    context.request("word_count", file="test")
+    sleep(0.5)
+    context.update_file("test", "one two")
+    context.request("word_count", file="test")
+
+    sleep(1)
+
+    output: list[Response] = context.get_response("word_count")  # type: ignore
+    assert [response["result"] for response in output] == [  # type: ignore
+        (3, 1),
+        (3, 1),
+        (3, 1),
+        (2, 2),
+    ]
+
+    context.kill_IPC()
+
+
+def test_file_store():
+    store = FileStore(memory_budget=30_000)
+    store["a"] = "a" * 10_000
+    store["b"] = "b" * 10_000
+    store["c"] = "c" * 10_000
+
+    assert list(store.spilled) == ["a"]
+    assert store["a"] == "a" * 10_000  # Restored, so "b" is now the oldest
+    assert list(store.spilled) == ["b"]
+    assert store.memory_report()["files_in_memory"] == 2
+
+    del store["b"]
+    assert "b" not in store
+    assert len(store) == 2
+    assert store.memory_bytes <= 30_000
+
+
+def test_memory_budget():
+    context = FileClient(
+        {"word_count": (word_count, True)},
+        file_hooks={"words": count_words},
+        memory_budget=30_000,
+    )
+
+    for name in "abc":
+        context.update_file(name, "word " * 2_000)
+    context.request("word_count", file="a")
+    sleep(0.5)
+    context.request_memory_report()  # Answered before any queued requests
+
+    sleep(1)
+
+    output: list[Response] = context.get_response("word_count")  # type: ignore
+    assert output[0]["result"] == (2_001, 1)  # type: ignore
+
+    report: Response = context.get_response("memory-report")  # type: ignore
+    assert report["result"]["files_spilled"] == 1  # type: ignore
+    assert report["result"]["memory_bytes"] <= 30_000  # type: ignore
+    assert context.files.memory_report()["files_spilled"] == 1
+
+    context.kill_IPC()
+
+
+def split_words(server: FileServer, file: str, contents: str) -> list[str]:
+    server.hook_runs = getattr(server, "hook_runs", 0) + 1  # type: ignore
+    return contents.split()
+
+
+def hook_runs(server: FileServer, arg: Request) -> int:
+    arg["file_indexes"]["words"]  # type: ignore
+    return server.hook_runs  # type: ignore
+
+
+def test_index_budget():
+    contents = "abcdefghijklmnopqrstuvwxyz0123456789 " * 500
+    file_bytes = getsizeof(contents) + object_size(contents.split())
+    # Room for four files and their indexes but not five
+    context = FileClient(
+        {"hook_runs": (hook_runs, True)},
+        file_hooks={"words": split_words},
+        memory_budget=file_bytes * 4 + file_bytes // 2,
+    )
+
+    for name in "abcde":
+        context.update_file(name, contents)
+    sleep(0.5)
+    for name in "abcde":
+        context.request("hook_runs", file=name)
+        sleep(0.1)
+    for name in "bcde":  # Their indexes are still cached
+        context.request("hook_runs", file=name)
+        sleep(0.1)
+    context.request_memory_report()
+
+    sleep(0.5)
+
+    output: list[Response] = context.get_response("hook_runs")  # type: ignore
+    assert output[-1]["result"] == 5
+
+    report: Response = context.get_response("memory-report")  # type: ignore
+    assert report["result"]["files_spilled"] == 1  # type: ignore
+
+    context.kill_IPC()
+
+
 if __name__ == "__main__":
     test_file_variants()
@@ -0,0 +1,63 @@
+from time import sleep
+
+from collegamento import Client, FileClient, Request
+from collegamento.client_server.trace import read_trace
+from collegamento.replay import replay_trace
+
+
+def foo(server, request):
+    return request["number"] * 2
+
+
+def split_str(server, arg: Request) -> list[str]:
+    return arg["file"].split(" ")  # type: ignore
+
+
+def test_record_and_replay(tmp_path):
+    trace_file = str(tmp_path / "trace.gz")
+
+    x = Client({"foo": (foo, True)})
+    x.request("foo", number=0)  # Not recorded
+    x.start_recording(trace_file)
+    x.request("foo", number=1)
+    sleep(0.2)
+    x.request("foo", number=2)
+    x.stop_recording()
+    x.kill_IPC()
+
+    header, records = read_trace(trace_file)
+    assert header["version"] == 1
+    assert [(command, kwargs) for _, command, kwargs in records] == [
+        ("foo", {"number": 1}),
+        ("foo", {"number": 2}),
+    ]
+    assert records[1][0] - records[0][0] >= 0.2
+
+    y = Client({"foo": (foo, True)})
+    report = replay_trace(trace_file, y, speed=4)
+    assert report["foo"]["requests"] == report["foo"]["answered"] == 2
+    assert report["all"]["answered"] == 2
+    assert 0 < report["foo"]["p50"] <= report["foo"]["max"]
+
+    output = y.get_response("foo")
+    assert [response["result"] for response in output] == [2, 4]  # type: ignore
+    y.kill_IPC()
+
+
+def test_replay_files(tmp_path):
+    trace_file = str(tmp_path / "trace.gz")
+
+    x = FileClient({"split": split_str})
+    x.start_recording(trace_file)
+    x.update_file("test", "a b c")
+    x.request("split", file="test")
+    x.stop_recording()
+    x.kill_IPC()
+
+    y = FileClient({"split": split_str})
+    report = replay_trace(trace_file, y, speed=None)
+    assert report["FileNotification"]["answered"] == 1
+    assert report["split"]["answered"] == 1
+    assert y.files["test"] == "a b c"
+    assert y.get_response("split")["result"] == ["a", "b", "c"]  # type: ignore
+    y.kill_IPC()
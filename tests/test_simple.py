@@ -1,12 +1,376 @@
-from time import sleep
+from asyncio import sleep as async_sleep
+from time import perf_counter, sleep
 
-from collegamento import Client, Response
+from collegamento import Client, Response, SchedulingPolicy
 
 
 def foo(server, request):
     print("Foo called", request["id"])
 
 
+def big_result(server, request):
+    return bytes(request["size"]) + b"end"
+
+
+class CountedPickles:
+    pickles = 0
+
+    def __reduce__(self):
+        CountedPickles.pickles += 1
+        return (CountedPickles, ())
+
+
+def counted(server, request):
+    return CountedPickles()
+
+
+def pickle_count(server, request):
+    return CountedPickles.pickles
+
+
+def test_large_results():
+    x = Client(
+        {
+            "big": (big_result, True),
+            "counted": counted,
+            "pickle_count": pickle_count,
+        },
+        large_result_threshold=1024,
+    )
+
+    x.request("big", size=10)  # Under the threshold, goes through the Queue
+    x.request("big", size=5_000_000)
+
+    sleep(1)
+
+    big_r: list[Response] = x.get_response("big")  # type: ignore
+    results = sorted([response["result"] for response in big_r], key=len)
+    assert results[0] == bytes(10) + b"end"
+    assert results[1] == bytes(5_000_000) + b"end"
+    assert all("shared_result" not in response for response in big_r)
+    assert all("pickled_result" not in response for response in big_r)
+
+    # Small results are only pickled once even though their size is checked
+    x.request("counted")
+    sleep(0.1)
+    x.request("pickle_count")
+    sleep(0.1)
+    assert isinstance(x.get_response("counted")["result"], CountedPickles)  # type: ignore
+    assert x.get_response("pickle_count")["result"] == 1  # type: ignore
+
+    sleep(0.1)
+    x.kill_IPC()
+
+
+def count_runs(server, request):
+    server.runs = getattr(server, "runs", 0) + 1
+    return (request["pane"], server.runs)
+
+
+def test_deduplicate_requests():
+    x = Client({"runs": (count_runs, True)}, deduplicate_commands=["runs"])
+
+    x.request("runs", pane=1)
+    x.request("runs", pane=1)
+    x.request("runs", pane=2)
+    x.request("runs", pane=1)
+
+    sleep(1)
+
+    runs_r: list[Response] = x.get_response("runs")  # type: ignore
+    assert len(runs_r) == 4
+    results = sorted(response["result"] for response in runs_r)
+    assert results == [(1, 1), (1, 1), (1, 1), (2, 2)]
+    collapsed = sorted(r.get("collapsed_requests", 1) for r in runs_r)
+    assert collapsed == [1, 3, 3, 3]
+    assert x.all_ids == []
+
+    x.request_stats()
+    sleep(0.1)
+    stats_r: Response = x.get_response("stats")  # type: ignore
+    assert stats_r["result"] == {"collapsed_requests": 2}
+
+    x.kill_IPC()
+
+    # Duplicates of a large result share one shared memory segment
+    y = Client(
+        {"big": (big_result, True)},
+        large_result_threshold=1024,
+        deduplicate_commands=["big"],
+    )
+
+    for _ in range(3):
+        y.request("big", size=100_000)
+
+    sleep(1)
+
+    big_r: list[Response] = y.get_response("big")  # type: ignore
+    assert len(big_r) == 3
+    assert all(r["result"] == bytes(100_000) + b"end" for r in big_r)
+    assert y.loaded_shared_results == {}
+
+    y.request_memory_report()
+    sleep(0.1)
+    report_r = y.get_response("memory-report")  # type: ignore
+    assert report_r["result"]["shared_result_bytes"] == 0  # type: ignore
+
+    y.kill_IPC()
+
+
+def slow(server, request):
+    return sum(range(100_000))
+
+
+def test_profiling_restart():
+    x = Client({"slow": (slow, True), "block": block})
+
+    x.start_profiling()
+    x.request("block")
+    x.stop_profiling()
+    x.start_profiling()  # Sent while the stop still waits on block
+    x.request("slow")
+    x.stop_profiling()
+
+    sleep(1)
+
+    profile_r: Response = x.get_response("profile")  # type: ignore
+    assert list(profile_r["result"]) == ["slow"]  # type: ignore
+    assert x.all_ids == []
+
+    x.kill_IPC()
+
+
+def test_profiling():
+    x = Client({"slow": (slow, True), "foo": foo})
+
+    x.request("slow")  # Not profiled
+    sleep(0.5)
+    x.start_profiling()
+    x.request("slow")
+    x.request("slow")
+    x.stop_profiling(limit=5)  # Waits for the requests sent before it
+
+    sleep(0.5)
+
+    profile_r: Response = x.get_response("profile")  # type: ignore
+    assert list(profile_r["result"]) == ["slow"]  # type: ignore
+    slow_profile = profile_r["result"]["slow"]  # type: ignore
+    assert slow_profile["calls"] == 2
+    assert 0 < len(slow_profile["functions"]) <= 5
+    assert any(f[2] == "slow" for f in slow_profile["functions"])
+    assert x.all_ids == []
+
+    x.kill_IPC()
+
+
+def hang(server, request):
+    sleep(5)
+
+
+def test_watchdog():
+    x = Client({"hang": hang, "foo": foo}, hang_thresholds={"hang": 0.5})
+
+    x.request("hang")
+    sleep(1)
+    x.request("foo")  # Noticed here, the hung Server is restarted first
+
+    events = x.get_watchdog_events()
+    assert [(event["type"], event["command"]) for event in events] == [
+        ("hung", "hang")
+    ]
+    assert events[0]["elapsed"] > 0.5
+
+    sleep(0.5)
+    assert x.get_response("foo")  # Got to the new Server
+
+    x.main_process.kill()
+    sleep(0.5)
+    x.request("foo")
+    events = x.get_watchdog_events()
+    assert [event["type"] for event in events] == ["dead"]
+    assert x.main_process.is_alive()
+
+    x.kill_IPC()
+
+
+async def wait_for(server, request):
+    await async_sleep(request["seconds"])
+    return request["seconds"]
+
+
+def test_async_commands():
+    x = Client(
+        {
+            "wait": (wait_for, True),
+            "newest_wait": wait_for,
+            "foo": (foo, True),
+        }
+    )
+
+    x.request("wait", seconds=0.6)
+    x.request("wait", seconds=0.2)
+    x.request("newest_wait", seconds=0.4)
+    sleep(0.1)
+    x.request("newest_wait", seconds=0.3)  # Cancels the running one
+    x.request("foo")  # Isn't blocked by the waits
+
+    sleep(0.15)
+    assert len(x.get_response("foo")) == 1  # type: ignore
+
+    sleep(0.2)
+    wait_r: list[Response] = x.get_response("wait")  # type: ignore
+    assert [response["result"] for response in wait_r] == [0.2]
+
+    sleep(0.5)
+    wait_r: list[Response] = x.get_response("wait")  # type: ignore
+    assert [response["result"] for response in wait_r] == [0.6]
+    newest_r: Response = x.get_response("newest_wait")  # type: ignore
+    assert newest_r["result"] == 0.3
+    assert x.all_ids == []
+
+    x.kill_IPC()
+
+
+async def spin(server, request):
+    await async_sleep(0)
+    sleep(3)  # Blocks the event loop
+
+
+async def fail(server, request):
+    raise ValueError
+
+
+def test_async_watchdog():
+    x = Client(
+        {"spin": spin, "fail": fail, "wait": (wait_for, True)},
+        hang_thresholds={"spin": 0.5},
+    )
+
+    x.request("wait", seconds=0.1)
+    x.request("spin")
+    sleep(1)
+    x.request("wait", seconds=0.1)
+
+    events = x.get_watchdog_events()
+    assert [(event["type"], event["command"]) for event in events] == [
+        ("hung", "spin")
+    ]
+
+    sleep(0.3)
+    wait_r: list[Response] = x.get_response("wait")  # type: ignore
+    assert [response["result"] for response in wait_r] == [0.1]
+
+    # Like a normal command an error kills the Server which is restarted
+    x.request("fail")
+    sleep(0.5)
+    x.request("wait", seconds=0.1)
+    assert [event["type"] for event in x.get_watchdog_events()] == ["dead"]
+
+    x.kill_IPC()
+
+
+def run_order(server, request):
+    server.order = getattr(server, "order", 0) + 1
+    return (request["name"], server.order)
+
+
+def block(server, request):
+    sleep(0.3)
+
+
+def command_kwargs(server, request):
+    return {
+        key: value
+        for key, value in request.items()
+        if key not in ("id", "type", "command")
+    }
+
+
+def test_scheduling_policy():
+    policy = SchedulingPolicy({"urgent": 10})
+    x = Client(
+        {
+            "block": block,
+            "bulk": (run_order, True),
+            "urgent": (run_order, True),
+            "kwargs": command_kwargs,
+        },
+        scheduling_policy=policy,
+    )
+
+    x.request("block")  # So the rest are all waiting together
+    sleep(0.1)
+    x.request("bulk", name="first bulk")
+    x.request("bulk", name="second bulk")
+    x.request("urgent", name="urgent")
+    x.request("bulk", name="bumped bulk", request_priority=20)
+
+    sleep(1)
+
+    results = [
+        response["result"]
+        for response in x.get_response("bulk") + x.get_response("urgent")  # type: ignore
+    ]
+    assert [name for name, _ in sorted(results, key=lambda r: r[1])] == [
+        "bumped bulk",
+        "urgent",
+        "first bulk",
+        "second bulk",
+    ]
+
+    # request_priority is only for the Server, the command's own kwargs are untouched
+    x.request("kwargs", priority="high", request_priority=5)
+    sleep(0.2)
+    kwargs_r: Response = x.get_response("kwargs")  # type: ignore
+    assert kwargs_r["result"] == {"priority": "high"}
+
+    x.kill_IPC()
+
+
+def noop(server, request):
+    pass
+
+
+def test_replaced_command_cancels_pending():
+    x = Client({"block": (block, True), "noop": (noop, True)})
+
+    x.request("block")
+    sleep(0.1)
+    x.request("block")
+    x.request("noop")  # Still pending after the second block starts
+    x.request("noop")
+    sleep(0.35)
+    x.add_command("noop", noop, True)
+
+    sleep(0.6)
+    x.check_responses()
+    assert not x.get_response("noop")
+    assert x.all_ids == []
+
+    x.kill_IPC()
+
+
+def test_many_pending_requests():
+    x = Client(
+        {"block": block, "noop": (noop, True)},
+        scheduling_policy=SchedulingPolicy({"noop": 1}),
+    )
+
+    x.request("block")  # So they're all pending at once
+    for _ in range(4000):
+        x.request("noop")
+
+    start = perf_counter()
+    while x.all_ids and perf_counter() - start < 10:
+        x.check_responses()
+        sleep(0.01)
+
+    assert x.all_ids == []
+    assert perf_counter() - start < 5
+
+    x.kill_IPC()
+
+
 def test_normal_client():
     Client({"foo": foo})
     x = Client({"foo": (foo, True), "foo2": foo})